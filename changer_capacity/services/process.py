@@ -1,4 +1,6 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 from ..utils.geometry import drop_points_inside_polygons
 from ..utils.facilities_capacity import recompute
@@ -9,7 +11,7 @@ from blocksnet.config import service_types_config
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 default_json_path = os.path.join(BASE_DIR, "default", "default.json")
-SERVICES = pd.read_json(default_json_path).name.values
+SERVICES = frozenset(pd.read_json(default_json_path).name)
 
 def process(service_type: str, service, buildings_blocks, acc_mx, local_crs, demand_per_1000, base_count, m2_per_person, k):
     """
@@ -39,7 +41,7 @@ def process(service_type: str, service, buildings_blocks, acc_mx, local_crs, dem
         If service_type is not found in predefined SERVICES, prints an error message and returns None.
     """
     if service_type not in SERVICES:
-        print(f"{service_type} was not found. Possible services: {SERVICES}")
+        print(f"{service_type} was not found. Possible services: {sorted(SERVICES)}")
         return None
     
     service_gdf = impute_services(service, service_type)
@@ -66,12 +68,20 @@ def process(service_type: str, service, buildings_blocks, acc_mx, local_crs, dem
     service_blocks = aggregate_objects(buildings_blocks, service_gdf)[0]
     service_blocks_new = aggregate_objects(buildings_blocks, service_new)[0]
 
-    df = buildings_blocks[["population"]].join(service_blocks[["capacity"]])
-    df_new = buildings_blocks[["population"]].join(service_blocks_new[["capacity"]])
+    pop = buildings_blocks[["population"]]
+    df = pop.assign(capacity=service_blocks["capacity"])
+    df_new = pop.assign(capacity=service_blocks_new["capacity"])
 
-    _, demand, accessibility = service_types_config[service_type].values()
+    # явные ключи вместо распаковки .values(): не зависим от порядка вставки
+    cfg = service_types_config[service_type]
+    demand = cfg["demand"]
+    accessibility = cfg["accessibility"]
 
-    prov_df, _ = competitive_provision(df, acc_mx, accessibility, demand)
-    prov_df_new, _ = competitive_provision(df_new, acc_mx, accessibility, demand)
+    # расчёты независимы и в основном NumPy (GIL отпускается) — считаем параллельно
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_old = ex.submit(competitive_provision, df, acc_mx, accessibility, demand)
+        fut_new = ex.submit(competitive_provision, df_new, acc_mx, accessibility, demand)
+        prov_df, _ = fut_old.result()
+        prov_df_new, _ = fut_new.result()
 
     return result, prov_df, prov_df_new
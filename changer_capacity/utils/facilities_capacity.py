@@ -1,14 +1,27 @@
 from __future__ import annotations
 
 import math
+from dataclasses import dataclass
+
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+
+try:  # опциональное ускорение: pip install numba
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
 
 # ===== Константы / имена колонок =====
 CAP_COL = "capacity"
 CAP_TYPE_COL = "cap_type"          # 'base' | 'real'
-GEOM_TYPE_COL = "geom_type"        # 'Point' | 'Polygon'
+CAP_TYPE_BASE = 0                  # uint8-коды cap_type внутри пайплайна
+CAP_TYPE_REAL = 1
+GEOM_TYPE_COL = "geom_type"        # GEOS type id (int8): POINT_TYPE | POLYGON_TYPE
+POINT_TYPE = int(shapely.GeometryType.POINT)
+POLYGON_TYPE = int(shapely.GeometryType.POLYGON)
 BLOCK_ID_COL = "block_id"
 DEMAND_COL = "demand"              # спрос квартала (в людях)
 UNMET_COL = "unmet_block_demand"
@@ -29,7 +42,8 @@ def _ensure_crs(gdf: gpd.GeoDataFrame, epsg: int) -> gpd.GeoDataFrame:
     return gdf
 
 def _geom_type_series(gdf: gpd.GeoDataFrame) -> pd.Series:
-    return gdf.geometry.geom_type
+    # один векторный GEOS-вызов вместо построчного geom_type
+    return pd.Series(shapely.get_type_id(gdf.geometry.values), index=gdf.index)
 
 def _isclose(a: float, b: float, tol: float = 1e-6) -> bool:
     return abs(float(a) - float(b)) <= tol
@@ -39,13 +53,13 @@ def prepare_blocks_with_demand(
     blocks_gdf: gpd.GeoDataFrame,
     demand_per_1000: float,
     population_col: str = "population",
-    epsg: int = 3857,
+    _copy: bool = True,
 ) -> gpd.GeoDataFrame:
     """
     Добавляет спрос DEMAND_COL = population * demand_per_1000 / 1000.
-    Создаёт block_id, если нет.
+    Создаёт block_id, если нет. CRS должен быть приведён заранее (см. recompute).
     """
-    gb = _ensure_crs(blocks_gdf.copy(), epsg)
+    gb = blocks_gdf.copy() if _copy else blocks_gdf
     if population_col not in gb.columns:
         raise ValueError(f"blocks_gdf must contain '{population_col}'.")
     gb[DEMAND_COL] = (gb[population_col].fillna(0).astype(float) * float(demand_per_1000) / 1000.0)
@@ -57,12 +71,13 @@ def prepare_blocks_with_demand(
 def prepare_services_cap_types(
     service_gdf: gpd.GeoDataFrame,
     base_count: float,
-    epsg: int = 3857,
+    _copy: bool = True,
 ) -> gpd.GeoDataFrame:
     """
     Добавляет CAP_TYPE_COL ('base'|'real') на основе BASE_COUNT.
+    CRS должен быть приведён заранее (см. recompute).
     """
-    gf = _ensure_crs(service_gdf.copy(), epsg)
+    gf = service_gdf.copy() if _copy else service_gdf
     if CAP_COL not in gf.columns:
         raise ValueError(f"schools_gdf must contain '{CAP_COL}'.")
     if GEOM_TYPE_COL not in gf.columns:
@@ -78,17 +93,18 @@ def prepare_services_cap_types(
 
 # ===== 1) Совпадения Point↔Polygon: оставить полигоны, перенести real с точки на полигон =====
 def merge_points_into_polygons_keep_polys(
-    fac_gdf: gpd.GeoDataFrame
+    fac_gdf: gpd.GeoDataFrame,
+    _copy: bool = True,
 ) -> gpd.GeoDataFrame:
 
-    gdf = fac_gdf.copy()
+    gdf = fac_gdf.copy() if _copy else fac_gdf
     if GEOM_TYPE_COL not in gdf.columns:
         gdf[GEOM_TYPE_COL] = _geom_type_series(gdf)
     gdf[KEEP_COL] = True
     gdf[DROP_REASON_COL] = pd.NA
 
-    polys = gdf[gdf[GEOM_TYPE_COL] == "Polygon"].copy()
-    points = gdf[gdf[GEOM_TYPE_COL] == "Point"].copy()
+    polys = gdf[gdf[GEOM_TYPE_COL] == POLYGON_TYPE]
+    points = gdf[gdf[GEOM_TYPE_COL] == POINT_TYPE]
     if points.empty or polys.empty:
         return gdf
 
@@ -99,141 +115,245 @@ def merge_points_into_polygons_keep_polys(
 
     pts_idx = covered.index.unique()
 
-    # переносим real-точки на полигоны
-    real_pts = points.loc[pts_idx][points.loc[pts_idx, CAP_TYPE_COL] == "real"]
-    if not real_pts.empty:
-        join_real = gpd.sjoin(real_pts, polys[["geometry"]], how="left", predicate="within")
+    # переносим real-точки на полигоны: пары (точка, полигон) уже есть в j,
+    # второй sjoin не нужен
+    covered_real = covered[covered[CAP_TYPE_COL] == "real"]
+    if not covered_real.empty:
         # берём максимум capacity, если несколько real-точек попали в один полигон
-        per_poly = real_pts[[CAP_COL]].groupby(join_real["index_right"]).max()[CAP_COL]
-        polys.loc[per_poly.index, CAP_COL] = per_poly.values
-        polys.loc[per_poly.index, CAP_TYPE_COL] = "real"
+        per_poly = covered_real.groupby("index_right")[CAP_COL].max()
+        gdf.loc[per_poly.index, CAP_COL] = per_poly.values
+        gdf.loc[per_poly.index, CAP_TYPE_COL] = "real"
 
-    # помечаем покрытые точки как удалённые
+    # помечаем покрытые точки как удалённые и выбрасываем их из выхода
     gdf.loc[pts_idx, KEEP_COL] = False
     gdf.loc[pts_idx, DROP_REASON_COL] = "covered_by_polygon"
+    return gdf.drop(index=pts_idx)
 
-    # собрать обратно: полигоны (обновлённые) + оставшиеся точки
-    remaining_points = points.drop(index=pts_idx)
-    out = pd.concat([polys, remaining_points, gdf[(gdf[GEOM_TYPE_COL] != "Polygon") & (gdf[GEOM_TYPE_COL] != "Point")]], ignore_index=True)
-    if GEOM_TYPE_COL not in out.columns:
-        out[GEOM_TYPE_COL] = _geom_type_series(out)
-    out = out.merge(
-        gdf[[KEEP_COL, DROP_REASON_COL]].reset_index().rename(columns={"index": "_orig_idx"}),
-        left_index=True, right_index=True, how="left"
-    )
-    return gpd.GeoDataFrame(out.drop(columns=["_orig_idx"]), geometry="geometry", crs=fac_gdf.crs)
+# ===== SoA-представление сервисов для середины пайплайна =====
+@dataclass
+class FacilityArrays:
+    """
+    Параллельные ndarray-колонки сервисных объектов (structure-of-arrays).
+    Середина пайплайна работает с ними напрямую, без pandas block manager;
+    обратно в GeoDataFrame колонки возвращает to_frame().
+    """
+    geometry: np.ndarray      # shapely-геометрии
+    cap: np.ndarray           # float64, исходный capacity (NaN сохраняются)
+    cap_type: np.ndarray      # uint8: CAP_TYPE_BASE | CAP_TYPE_REAL
+    geom_type: np.ndarray     # GEOS type id
+    sanpin: np.ndarray        # float64, потолок СанПиН
+    cap_max: np.ndarray       # float64
+    block_id: np.ndarray      # int64, -1 = вне кварталов
+    demand: np.ndarray        # float64
+    add: np.ndarray           # float64, добавленная ёмкость
+    new_cap: np.ndarray       # float64
+    saturated: np.ndarray     # bool
+
+    @classmethod
+    def from_gdf(cls, gdf: gpd.GeoDataFrame) -> "FacilityArrays":
+        n = len(gdf)
+        cap = gdf[CAP_COL].astype(float).to_numpy()
+        if GEOM_TYPE_COL in gdf.columns:
+            geom_type = gdf[GEOM_TYPE_COL].to_numpy()
+        else:
+            geom_type = shapely.get_type_id(gdf.geometry.values)
+        cap_type = np.where(
+            gdf[CAP_TYPE_COL].to_numpy() == "real", CAP_TYPE_REAL, CAP_TYPE_BASE
+        ).astype(np.uint8)
+        return cls(
+            geometry=gdf.geometry.values,
+            cap=cap,
+            cap_type=cap_type,
+            geom_type=geom_type,
+            sanpin=np.full(n, np.inf),
+            cap_max=cap.copy(),
+            block_id=np.full(n, -1, dtype=np.int64),
+            demand=np.zeros(n),
+            add=np.zeros(n),
+            new_cap=cap.copy(),
+            saturated=np.zeros(n, dtype=bool),
+        )
+
+    def to_frame(self, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """Приписывает рассчитанные колонки обратно к gdf (финальная материализация)."""
+        gdf[SANPIN_COL] = self.sanpin
+        gdf[BLOCK_ID_COL] = self.block_id
+        gdf[DEMAND_COL] = self.demand
+        gdf[CAP_MAX_COL] = self.cap_max
+        gdf[NEW_CAP_COL] = self.new_cap
+        gdf[ADD_CAP_COL] = self.add
+        gdf[SAT_COL] = self.saturated
+        gdf[UNMET_COL] = 0.0
+        return gdf
 
 # ===== 2) СанПиН потолок (для полигонов с base) =====
-def add_sanpin_ceiling(
-    fac_gdf: gpd.GeoDataFrame,
-    m2_per_person: float = 5.0
-) -> gpd.GeoDataFrame:
-    gdf = fac_gdf.copy()
-    if GEOM_TYPE_COL not in gdf.columns:
-        gdf[GEOM_TYPE_COL] = _geom_type_series(gdf)
-    gdf[SANPIN_COL] = np.inf
-    areas = gdf.geometry.area
-    mask = (gdf[GEOM_TYPE_COL] == "Polygon") & (gdf[CAP_TYPE_COL] == "base")
-    gdf.loc[mask, SANPIN_COL] = np.floor(areas.loc[mask] / float(m2_per_person)).astype(float)
-    return gdf
+def add_sanpin_ceiling(arrs: FacilityArrays, m2_per_person: float = 5.0) -> FacilityArrays:
+    mask = (arrs.geom_type == POLYGON_TYPE) & (arrs.cap_type == CAP_TYPE_BASE)
+    areas = shapely.area(arrs.geometry[mask])
+    arrs.sanpin[mask] = np.floor(areas / float(m2_per_person))
+    return arrs
 
 # ===== 3) Привязка к кварталам =====
-def attach_blocks(
-    fac_gdf: gpd.GeoDataFrame,
-    blocks_gdf: gpd.GeoDataFrame
-) -> gpd.GeoDataFrame:
-    gf = fac_gdf.copy()
-    gb = blocks_gdf.copy()
-    if GEOM_TYPE_COL not in gf.columns:
-        gf[GEOM_TYPE_COL] = _geom_type_series(gf)
+def attach_blocks(arrs: FacilityArrays, blocks_gdf: gpd.GeoDataFrame) -> FacilityArrays:
+    gb = blocks_gdf  # только читаем
 
-    # точки — как есть; полигоны — центроиды
-    anchors = gf.geometry.copy()
-    poly_mask = (gf[GEOM_TYPE_COL] == "Polygon")
-    anchors.loc[poly_mask] = gf.loc[poly_mask].geometry.centroid
-    pts = gpd.GeoDataFrame(gf.drop(columns=["geometry"]), geometry=anchors, crs=gf.crs)
-
-    sj = gpd.sjoin(pts, gb[[BLOCK_ID_COL, DEMAND_COL, "geometry"]], how="left", predicate="within")
-    gf[BLOCK_ID_COL] = sj[BLOCK_ID_COL].values
-    gf[DEMAND_COL] = sj[DEMAND_COL].values
-    gf[BLOCK_ID_COL] = gf[BLOCK_ID_COL].fillna(-1).astype(int)
-    gf[DEMAND_COL] = gf[DEMAND_COL].fillna(0.0).astype(float)
-    return gf
+    # точки — как есть; полигоны — центроиды (один векторный GEOS-вызов)
+    anchors = arrs.geometry.copy()
+    poly_mask = arrs.geom_type == POLYGON_TYPE
+    anchors[poly_mask] = shapely.centroid(arrs.geometry[poly_mask])
+
+    # вместо sjoin: запрос к R-дереву кварталов, результат — пары индексов
+    tree = shapely.STRtree(gb.geometry.values)
+    pairs = tree.query(anchors, predicate="within")
+    arrs.block_id[pairs[0]] = gb[BLOCK_ID_COL].to_numpy()[pairs[1]]
+    arrs.demand[pairs[0]] = gb[DEMAND_COL].to_numpy(dtype=float)[pairs[1]]
+    return arrs
 
 # ===== 4) cap_max для базовых =====
-def add_cap_max(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    base = gdf[CAP_COL].astype(float).fillna(0.0)
-    triple = 3.0 * base
-    sanpin = gdf.get(SANPIN_COL, pd.Series(np.inf, index=gdf.index)).astype(float)
-    cap_max = base.copy()
-    mask_base = (gdf[CAP_TYPE_COL] == "base")
-    cap_max.loc[mask_base] = np.minimum(triple.loc[mask_base], sanpin.loc[mask_base])
-    gdf[CAP_MAX_COL] = cap_max
-    return gdf
+def add_cap_max(arrs: FacilityArrays) -> FacilityArrays:
+    cap0 = np.where(np.isnan(arrs.cap), 0.0, arrs.cap)
+    arrs.cap_max = cap0.copy()
+    mask_base = arrs.cap_type == CAP_TYPE_BASE
+    arrs.cap_max[mask_base] = np.minimum(3.0 * cap0[mask_base], arrs.sanpin[mask_base])
+    return arrs
 
 # ===== 5) Нелинейное распределение относительно максимального спроса =====
-def allocate_relative_to_max(
-    gdf: gpd.GeoDataFrame,
-    k: float = 2.0,
-) -> gpd.GeoDataFrame:
-    out = gdf.copy()
-    out[NEW_CAP_COL] = out[CAP_COL].astype(float).values
-    out[ADD_CAP_COL] = 0.0
-    out[SAT_COL] = False
-    out[UNMET_COL] = 0.0
+def _fill_blocks_numpy(head, demand_b, seg_start, seg_count, k, dmax_global, w_max):
+    """Водораздел по сегментам в замкнутой форме (fallback без numba)."""
+    seg_id = np.repeat(np.arange(len(seg_start)), seg_count)
+    nan_mask = np.isnan(head)
+
+    # сегментные редукции пропускают NaN (как pandas .sum()/.max());
+    # сами NaN-строки получают NaN add, как и раньше
+    head_finite = np.where(nan_mask, 0.0, head)
+    total_head = np.add.reduceat(head_finite, seg_start)
+    head_max_local = np.maximum.reduceat(head_finite, seg_start)
+    n_finite = np.add.reduceat((~nan_mask).astype(np.int64), seg_start)
+
+    # вес блока по спросу
+    w_block = np.exp(k * (demand_b / dmax_global))
+
+    # бюджет блока: хотим, чтобы блок с максимальным спросом получал head_max_local
+    # множитель seg_count слегка выравнивает блоки с множеством объектов
+    T = head_max_local * (w_block / w_max) * seg_count
+    add_total = np.minimum(T, total_head)
+    active = (demand_b > 0) & (total_head > 0) & (add_total > 0)
+
+    # водораздел в замкнутой форме: сортируем headroom внутри сегмента
+    # (NaN уходят в конец) и сканом префиксных сумм находим уровень воды lam,
+    # при котором sum(min(head, lam)) == add_total; тогда add = min(head, lam)
+    sort_idx = np.lexsort((head, seg_id))
+    h_sorted = head_finite[sort_idx]
+    rank = np.arange(len(head)) - seg_start[seg_id]
+
+    cs = np.cumsum(h_sorted)
+    prefix = cs - h_sorted - np.repeat(cs[seg_start] - h_sorted[seg_start], seg_count)
+    # элемент насыщен, если уровень воды поднимается выше его headroom
+    sat = prefix + (n_finite[seg_id] - rank) * h_sorted <= add_total[seg_id] + 1e-9
+    sat &= ~nan_mask[sort_idx]
+
+    n_sat = np.add.reduceat(sat.astype(np.int64), seg_start)
+    sat_sum = np.add.reduceat(np.where(sat, h_sorted, 0.0), seg_start)
+    n_free = n_finite - n_sat
+    # n_free == 0 — бюджет съедает весь headroom: уровень выше любого head
+    lam = np.where(n_free > 0, (add_total - sat_sum) / np.where(n_free > 0, n_free, 1), np.inf)
+
+    add = np.minimum(head, lam[seg_id])  # NaN-строки дают NaN add
+    return add, active
+
+if _HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _fill_blocks_numba(head, demand_b, seg_start, seg_count, k, dmax_global, w_max, add, active):
+        # тот же алгоритм, что и _fill_blocks_numpy, но одним слитным проходом
+        # по сегментам; prange раскидывает кварталы по ядрам
+        for b in prange(len(seg_start)):
+            s = seg_start[b]
+            e = s + seg_count[b]
+            total_head = 0.0
+            head_max_local = 0.0
+            for i in range(s, e):
+                h = head[i]
+                if not np.isnan(h):
+                    total_head += h
+                    if h > head_max_local:
+                        head_max_local = h
+            if demand_b[b] <= 0 or total_head <= 0:
+                continue
+            w_block = np.exp(k * (demand_b[b] / dmax_global))
+            T = head_max_local * (w_block / w_max) * seg_count[b]
+            add_total = T if T < total_head else total_head
+            if add_total <= 0:
+                continue
+            active[b] = True
+
+            # водораздел в замкнутой форме по финитным headroom сегмента
+            h_local = np.empty(e - s)
+            n_fin = 0
+            for i in range(s, e):
+                if not np.isnan(head[i]):
+                    h_local[n_fin] = head[i]
+                    n_fin += 1
+            h_fin = np.sort(h_local[:n_fin])
+
+            # насыщенный префикс: уровень воды выше headroom элемента
+            n_sat = 0
+            sat_sum = 0.0
+            prefix = 0.0
+            for j in range(n_fin):
+                if prefix + (n_fin - j) * h_fin[j] <= add_total + 1e-9:
+                    n_sat += 1
+                    sat_sum += h_fin[j]
+                else:
+                    break
+                prefix += h_fin[j]
+            if n_sat < n_fin:
+                lam = (add_total - sat_sum) / (n_fin - n_sat)
+            else:
+                lam = np.inf  # бюджет съедает весь headroom
+
+            for i in range(s, e):
+                h = head[i]
+                if np.isnan(h):
+                    add[i] = np.nan  # NaN-строки дают NaN add, как в numpy-пути
+                else:
+                    add[i] = h if h < lam else lam
+
+def _fill_blocks(head, demand_b, seg_start, seg_count, k, dmax_global, w_max):
+    if _HAS_NUMBA:
+        add = np.zeros(len(head))
+        active = np.zeros(len(seg_start), dtype=bool)
+        _fill_blocks_numba(
+            head, demand_b,
+            seg_start.astype(np.int64), seg_count.astype(np.int64),
+            float(k), float(dmax_global), float(w_max),
+            add, active,
+        )
+        return add, active
+    return _fill_blocks_numpy(head, demand_b, seg_start, seg_count, k, dmax_global, w_max)
+
+def allocate_relative_to_max(arrs: FacilityArrays, k: float = 2.0) -> FacilityArrays:
+    dmax_global = max(float(np.nanmax(arrs.demand)) if len(arrs.demand) else 0.0, 1.0)
+    w_max = math.exp(k * 1.0)
 
-    if CAP_MAX_COL not in out.columns:
-        out = add_cap_max(out)
+    # работаем только с base-строками, сгруппированными по кварталу:
+    # сортировка даёт непрерывные сегменты для сегментных редукций
+    base_pos = np.flatnonzero(arrs.cap_type == CAP_TYPE_BASE)
+    if len(base_pos) > 0:
+        order = base_pos[np.argsort(arrs.block_id[base_pos], kind="stable")]
+        head = np.maximum(arrs.cap_max[order] - arrs.cap[order], 0.0)
+        _, seg_start, seg_count = np.unique(arrs.block_id[order], return_index=True, return_counts=True)
+        demand_b = arrs.demand[order][seg_start]
 
-    dmax_global = max(out[DEMAND_COL].max(), 1.0)
-    w_max = math.exp(k * 1.0)
+        add, active = _fill_blocks(head, demand_b, seg_start, seg_count, k, dmax_global, w_max)
+
+        # применяем: меняем только base в активных кварталах
+        row_active = np.repeat(active, seg_count)
+        touched = order[row_active]
+        arrs.add[touched] = add[row_active]
+        arrs.new_cap[touched] = np.round(arrs.cap[touched] + add[row_active], 0)
+        arrs.saturated[touched] = np.isclose(arrs.new_cap[touched], arrs.cap_max[touched])
 
-    for bid, bdf in out.groupby(BLOCK_ID_COL, group_keys=False):
-        demand_b = float(bdf[DEMAND_COL].iloc[0])
-        if demand_b <= 0:
-            continue
-
-        idx_base = bdf.index[bdf[CAP_TYPE_COL] == "base"]
-        if len(idx_base) == 0:
-            continue
-
-        head = (out.loc[idx_base, CAP_MAX_COL] - out.loc[idx_base, CAP_COL]).clip(lower=0).astype(float)
-        total_head = head.sum()
-        if total_head <= 0:
-            continue
-
-        # вес блока по спросу
-        w_block = math.exp(k * (demand_b / dmax_global))
-        head_max_local = head.max()
-
-        # бюджет блока: хотим, чтобы блок с максимальным спросом получал head_max_local
-        # множитель len(idx_base) слегка выравнивает блоки с множеством объектов
-        T = head_max_local * (w_block / w_max) * len(idx_base)
-        add_total = min(T, total_head)
-        if add_total <= 0:
-            continue
-
-        # старт: пропорционально headroom (мягко)
-        add = (head / head.sum()) * add_total
-
-        # водораздел: клип по headroom и перераспределение излишка
-        for _ in range(12):
-            over = add - head
-            if (over <= 1e-9).all():
-                break
-            surplus = over.clip(lower=0).sum()
-            add = np.minimum(add, head)
-            free = (add < head - 1e-12)
-            if not free.any():
-                break
-            add[free] += surplus * (head[free] / head[free].sum())
-
-        # применяем: меняем только base
-        out.loc[idx_base, ADD_CAP_COL] = add
-        out.loc[idx_base, NEW_CAP_COL] = round(out.loc[idx_base, CAP_COL] + add, 0)
-        out.loc[idx_base, SAT_COL] = np.isclose(out.loc[idx_base, NEW_CAP_COL], out.loc[idx_base, CAP_MAX_COL])
-
-    return out
+    return arrs
 
 # ===== 6) Главный пайплайн =====
 def recompute(
@@ -251,24 +371,38 @@ def recompute(
     где у базовых геометрий рассчитаны новые capacity.
     Поля на выходе: capacity, cap_type, sanpin_cap, cap_max, added_capacity, new_capacity, saturated, keep, drop_reason, block_id, demand
     """
+    # 0) CRS приводим ровно один раз; to_crs сам возвращает новую таблицу,
+    # иначе делаем одну защитную копию — дальше стадии работают поверх неё
+    gb = _ensure_crs(blocks_gdf, epsg)
+    gf = _ensure_crs(service_gdf, epsg)
+    if gb is blocks_gdf:
+        gb = gb.copy()
+    if gf is service_gdf:
+        gf = gf.copy()
+
     # 1) подготовить блоки с реальным спросом
-    gb = prepare_blocks_with_demand(blocks_gdf, demand_per_1000=demand_per_1000, epsg=epsg)
+    gb = prepare_blocks_with_demand(gb, demand_per_1000=demand_per_1000, _copy=False)
 
     # 2) подготовить сервис: cap_type
-    gf = prepare_services_cap_types(service_gdf, base_count=base_count, epsg=epsg)
+    gf = prepare_services_cap_types(gf, base_count=base_count, _copy=False)
 
     # 3) совпадения point↔polygon (оставляем полигоны)
-    gf = merge_points_into_polygons_keep_polys(gf)
+    gf = merge_points_into_polygons_keep_polys(gf, _copy=False)
+
+    # дальше — SoA: один съём массивов из GeoDataFrame, стадии без pandas
+    arrs = FacilityArrays.from_gdf(gf)
 
     # 4) санпин потолок
-    gf = add_sanpin_ceiling(gf, m2_per_person=m2_per_person)
+    arrs = add_sanpin_ceiling(arrs, m2_per_person=m2_per_person)
 
     # 5) привязка к кварталам
-    gf = attach_blocks(gf, gb)
+    arrs = attach_blocks(arrs, gb)
 
     # 6) cap_max
-    gf = add_cap_max(gf)
+    arrs = add_cap_max(arrs)
 
     # 7) нелинейная аллокация относительно максимального спроса
-    out = allocate_relative_to_max(gf, k=k)
-    return out
+    arrs = allocate_relative_to_max(arrs, k=k)
+
+    # материализуем колонки обратно в GeoDataFrame
+    return arrs.to_frame(gf)
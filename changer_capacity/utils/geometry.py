@@ -1,5 +1,10 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+
+# при совсем малом числе полигонов дешевле один prepared-union, чем R-дерево
+_PREPARED_UNION_MAX_POLYS = 8
 
 def drop_points_inside_polygons(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
 
@@ -9,7 +14,18 @@ def drop_points_inside_polygons(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     if polys.empty or points.empty:
         return gdf.reset_index(drop=True).copy()
 
-    union_poly = polys.union_all()
-    points_outside = points[~points.geometry.within(union_poly)]
+    if len(polys) <= _PREPARED_UNION_MAX_POLYS:
+        # prepared-геометрия: contains как GIL-released ufunc по всем точкам
+        union_poly = shapely.union_all(polys.geometry.values)
+        shapely.prepare(union_poly)
+        inside_mask = shapely.contains(union_poly, points.geometry.values)
+    else:
+        # R-дерево вместо union_all(): проверяем только точки-кандидаты
+        tree = shapely.STRtree(polys.geometry.values)
+        pairs = tree.query(points.geometry.values, predicate="within")
+        inside_mask = np.zeros(len(points), dtype=bool)
+        inside_mask[pairs[0]] = True
+
+    points_outside = points[~inside_mask]
     cleaned = pd.concat([polys, points_outside], ignore_index=True)
     return cleaned.reset_index(drop=True).copy()
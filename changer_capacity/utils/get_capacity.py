@@ -6,10 +6,8 @@ default_json_path = os.path.join(BASE_DIR, "default", "default.json")
 
 def get_min_capacity():
     df = pd.read_json(default_json_path)
-    
-    result_df = df.apply(lambda row: {
-        'name': row['name'],
-        'capacity': min(unit['capacity'] for unit in row['units']) if row['units'] else None
-    }, axis=1)
 
-    return pd.DataFrame(result_df.tolist())
\ No newline at end of file
+    units = df[['name', 'units']].explode('units')
+    units['capacity'] = units['units'].str['capacity']
+
+    return units.groupby('name', sort=False)['capacity'].min().reset_index()
\ No newline at end of file
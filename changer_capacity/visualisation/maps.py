@@ -1,8 +1,25 @@
+import json
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import folium
 from folium.features import GeoJsonPopup
 from branca.colormap import LinearColormap
+from pyproj import Transformer
+
+@lru_cache(maxsize=8)
+def _wgs84_transformer(crs_wkt: str) -> Transformer:
+    return Transformer.from_crs(crs_wkt, 4326, always_xy=True)
+
+def _to_wgs84(geoms: np.ndarray, crs) -> np.ndarray:
+    # один C-проход pyproj по плоскому массиву координат вместо to_crs
+    tr = _wgs84_transformer(crs.to_wkt()).transform
+    coords = shapely.get_coordinates(geoms)
+    x2, y2 = tr(coords[:, 0], coords[:, 1])
+    return shapely.set_coordinates(geoms.copy(), np.column_stack([x2, y2]))
 
 def make_blocks_capacity(
     buildings_blocks: gpd.GeoDataFrame,
@@ -13,13 +30,17 @@ def make_blocks_capacity(
     prov_id_col_old: str | None = None,  # id в prov_df_old (если None — индекс)
     prov_id_col_new: str | None = None,  # id в prov_df_new (если None — индекс)
     capacity_col: str = "capacity",
-    drop_invalid: bool = True
+    drop_invalid: bool = True,
+    simplify_tolerance: float | None = None,  # в градусах (WGS84); None — без упрощения
 ) -> folium.Map:
-    # --- геометрия -> WGS84
-    gdf = buildings_blocks.copy()
+    # --- геометрия -> WGS84; берём только нужные колонки, а не весь фрейм
+    keep_cols = [c for c in (id_col,) if c and c in buildings_blocks.columns]
+    gdf = buildings_blocks[keep_cols + ["geometry"]].copy()
     if gdf.crs is None:
         gdf = gdf.set_crs(3857, allow_override=True)
-    gdf = gdf.to_crs(4326)
+    gdf = gdf.set_geometry(
+        gpd.GeoSeries(_to_wgs84(gdf.geometry.values, gdf.crs), index=gdf.index, crs=4326)
+    )
 
     if drop_invalid:
         gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
@@ -56,11 +77,14 @@ def make_blocks_capacity(
     m.fit_bounds([[miny, minx], [maxy, maxx]])
 
     # === 1) Общая шкала для old & new ===
-    both = pd.concat([gdf["capacity_old"], gdf["capacity_new"]], axis=0)
-    both = pd.to_numeric(both, errors="coerce")
-    if both.notna().any():
-        vmin_common = float(both.min(skipna=True))
-        vmax_common = float(both.max(skipna=True))
+    # колонки уже числовые после to_numeric выше — min/max прямо по ndarray
+    both = np.concatenate([
+        gdf["capacity_old"].to_numpy(dtype=float),
+        gdf["capacity_new"].to_numpy(dtype=float),
+    ])
+    if not np.isnan(both).all():
+        vmin_common = float(np.nanmin(both))
+        vmax_common = float(np.nanmax(both))
         if vmin_common == vmax_common:
             vmax_common = vmin_common + 1.0
     else:
@@ -71,10 +95,10 @@ def make_blocks_capacity(
     cmap_common.add_to(m)
 
     # === 2) Дивергентная шкала для Δ ===
-    delta_vals = pd.to_numeric(gdf["capacity_delta"], errors="coerce")
-    if delta_vals.notna().any():
-        vmin_d = float(delta_vals.min(skipna=True))
-        vmax_d = float(delta_vals.max(skipna=True))
+    delta_vals = gdf["capacity_delta"].to_numpy(dtype=float)
+    if not np.isnan(delta_vals).all():
+        vmin_d = float(np.nanmin(delta_vals))
+        vmax_d = float(np.nanmax(delta_vals))
         if vmin_d == vmax_d:
             # немного расширим диапазон, чтобы была видна легенда
             vmin_d, vmax_d = vmin_d - 1.0, vmax_d + 1.0
@@ -85,28 +109,43 @@ def make_blocks_capacity(
     cmap_delta.caption = "Δ Capacity: negative → positive"
     cmap_delta.add_to(m)
 
+    # --- общий payload для всех трёх слоёв: одна таблица, при желании с
+    # упрощённой геометрией (меньше JSON и меньше HTML на клиенте)
+    if simplify_tolerance is not None:
+        simplified = shapely.simplify(gdf.geometry.values, simplify_tolerance, preserve_topology=True)
+        gdf = gdf.set_geometry(gpd.GeoSeries(simplified, index=gdf.index, crs=4326))
+    payload = gdf[[id_col, "capacity_old", "capacity_new", "capacity_delta", "geometry"]]
+
+    # --- три слоя: оба по общей шкале + дельта по дивергентной
+    layer_specs = [
+        ("capacity_old", "Capacity (old)", cmap_common, False),
+        ("capacity_new", "Capacity (new)", cmap_common, True),
+        ("capacity_delta", "Δ Capacity (abs)", cmap_delta, True),
+    ]
+
+    # цвета считаем один раз; style_function только читает готовый hex
+    for color_col, _, cmap, _ in layer_specs:
+        vals = pd.to_numeric(payload[color_col], errors="coerce")
+        if vals.notna().any():
+            payload["_color_" + color_col] = [cmap(v) if pd.notna(v) else "#ffffff" for v in vals]
+
+    # одна сериализация FeatureCollection на все три слоя
+    payload_json = json.loads(payload.to_json())
+
     # --- утилита добавления слоя с POPUP при клике
-    def add_layer(df, color_col, name, cmap, show=True, outline="#222", weight=0.7, fill_opacity=0.9):
-        vals = pd.to_numeric(df[color_col], errors="coerce")
-        if not vals.notna().any():
+    def add_layer(color_col, name, show=True, outline="#222", weight=0.7, fill_opacity=0.9):
+        color_key = "_color_" + color_col
+        if color_key not in payload.columns:  # нет данных для слоя
             return
 
         def style(feat):
-            v = feat["properties"].get(color_col, None)
-            try:
-                vv = float(v) if v is not None else None
-            except Exception:
-                vv = None
             return {
                 "color": outline,
                 "weight": weight,
                 "fillOpacity": fill_opacity,
-                "fillColor": cmap(vv) if vv is not None else "#ffffff",
+                "fillColor": feat["properties"][color_key],
             }
 
-        # в payload включаем сразу все три значения, чтобы popup всегда их показывал
-        payload = df[[id_col, "capacity_old", "capacity_new", "capacity_delta", "geometry"]]
-
         popup = GeoJsonPopup(
             fields=[id_col, "capacity_old", "capacity_new", "capacity_delta"],
             aliases=["ID", "Capacity (old)", "Capacity (new)", "Δ Capacity"],
@@ -116,17 +155,15 @@ def make_blocks_capacity(
 
         layer = folium.FeatureGroup(name=name, show=show, overlay=True)
         folium.GeoJson(
-            payload,
+            payload_json,
             name=name,
             style_function=style,
             popup=popup
         ).add_to(layer)
         layer.add_to(m)
 
-    # --- три слоя: оба по общей шкале + дельта по дивергентной
-    add_layer(gdf, "capacity_old", "Capacity (old)", cmap_common, show=False)
-    add_layer(gdf, "capacity_new", "Capacity (new)", cmap_common, show=True)
-    add_layer(gdf, "capacity_delta", "Δ Capacity (abs)", cmap_delta, show=True)
+    for color_col, name, _, show in layer_specs:
+        add_layer(color_col, name, show=show)
 
     folium.LayerControl(collapsed=False).add_to(m)
     return m